@@ -2,7 +2,8 @@
 """Persistent mini-REPL for RLM-style workflows in OpenCode.
 
 This script provides a *stateful* Python environment across invocations by
-saving a pickle file to disk. It is intentionally small and dependency-free.
+saving pickle files under a state directory. It is intentionally small and
+dependency-free.
 
 Works with any content type: source code, logs, configs, data files, documents.
 
@@ -20,12 +21,13 @@ Typical flow:
 
 The script injects these variables into the exec environment:
   - context: dict with keys {path, loaded_at, content, files?}
-  - content: string alias for context['content']
+  - content: string alias for context['content'] (bytes with init --as-bytes)
   - buffers: list[str] for storing intermediate text results
 
 It also injects helpers:
   - peek(start=0, end=1000) -> str
   - grep(pattern, max_matches=20, window=200, flags=0) -> list[dict]
+  - grep_many(patterns, max_matches=20, flags=0) -> dict[str, list[dict]]
   - grep_count(pattern, flags=0) -> int
   - chunk_indices(size=200000, overlap=0) -> list[(start,end)]
   - write_chunks(out_dir, size=200000, overlap=0, prefix='chunk') -> list[str]
@@ -36,6 +38,14 @@ It also injects helpers:
   - time_range() -> dict (for log analysis)
   - stats() -> dict (content statistics)
 
+Other variables the code leaves behind persist too. Variables that share
+objects are saved together, so `b = a` still aliases in later calls; a
+variable bound to `buffers` or part of `context` is saved as a separate copy.
+
+With --as-bytes the helpers search with bytes regexes (str patterns are
+encoded as UTF-8, so \\w and friends are ASCII-only), report byte offsets, and
+decode only the slices they return.
+
 Security note:
   This runs arbitrary Python via exec. Treat it like running code you wrote.
 """
@@ -43,21 +53,36 @@ Security note:
 from __future__ import annotations
 
 import argparse
+import bisect
+import gc
+import hashlib
 import io
 import json
+import marshal
+import mmap
 import os
 import pickle
 import re
+import shutil
+import struct
 import sys
 import textwrap
 import time
 import traceback
+import types
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import redirect_stderr, redirect_stdout
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json parser is used instead.
+    orjson = None
 
-DEFAULT_STATE_PATH = Path(".opencode/rlm_state/state.pkl")
+DEFAULT_STATE_DIR = Path(".opencode/rlm_state")
 DEFAULT_MAX_OUTPUT_CHARS = 8000
 
 DEFAULT_EXCLUDE_DIRS = {
@@ -67,6 +92,71 @@ DEFAULT_EXCLUDE_DIRS = {
     "vendor", "coverage", ".cache",
 }
 
+# Fixed patterns used by the helpers, compiled once at import.
+_TS_PATTERNS = [
+    re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}'),  # ISO format
+    re.compile(r'\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}'),    # Apache format
+    re.compile(r'\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}'),    # Syslog format
+]
+# time_range() looks for the last timestamp in this many trailing chars first;
+# a hit closer than the margin to the window start may be a cut-off timestamp.
+_TS_TAIL_WINDOW = 8192
+_TS_TAIL_MARGIN = 64
+_ERR_RE = re.compile(r'\b(ERROR|FATAL|CRITICAL)\b', re.I)
+_WARN_RE = re.compile(r'\bWARN(ING)?\b', re.I)
+_YAML_DOC_SEP = re.compile(r'^---\s*$', re.MULTILINE)
+_NON_EMPTY_LINE_RE = re.compile(r'^[^\S\n]*\S', re.MULTILINE)
+
+# State directory layout: the (large, rarely changing) content is kept apart,
+# as raw UTF-8, from the small runtime state that every exec rewrites.
+CONTENT_FILE = "content.bin"
+RUNTIME_FILE = "runtime.pkl"
+# Single-pickle state written by older versions, where --state named this file.
+LEGACY_STATE_FILE = "state.pkl"
+GLOBALS_DIR = "globals"
+GLOBALS_INDEX = "index.pkl"
+CODE_CACHE_DIR = ".codecache"
+# Sources shorter than this compile faster than a cache lookup plus write pays
+# back, and are mostly one-off; at most this many entries are kept.
+CODE_CACHE_MIN_CHARS = 2048
+CODE_CACHE_MAX_ENTRIES = 64
+
+# Persisted variables are pickled with protocol 5 where available, so objects
+# exposing PickleBuffers (numpy arrays, ...) have their data written out-of-band
+# after the pickle stream instead of copied into it. Such files start with this magic.
+_OOB_MAGIC = b"RLMOOB1\n"
+_OOB_SUPPORTED = pickle.HIGHEST_PROTOCOL >= 5
+
+# write_chunks() writes chunk files from a small thread pool (file I/O releases the GIL).
+_MAX_WRITE_WORKERS = 8
+
+# Every exec is a new process and importing numpy takes ~60 ms, so the numpy
+# paths only run (and import it) for inputs large enough to win that back.
+_NUMPY_MIN_CHARS = 32 << 20
+_NUMPY_MIN_SPANS = 500_000
+# numba takes ~0.35 s to import and load its cached kernels and beats numpy's
+# line scan by only ~0.3 ms/MB, so it is reserved for very large content.
+_NUMBA_MIN_CHARS = 1 << 30
+
+# re flags with a Hyperscan equivalent; grep_many uses re for any others.
+_HYPERSCAN_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
+
+# Seeing any of these in exec'd code means it may reach persisted variables by
+# name at runtime, so every persisted variable is loaded up front.
+_DYNAMIC_NAME_ACCESS = {"globals", "locals", "vars", "dir", "eval", "exec"}
+
+# Values of these types cannot change in place; if exec left the very same
+# object bound, its file does not need rewriting.
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None), frozenset, range)
+
+# Leaf types _mutable_objects() does not look into, and types pickled by
+# reference that it does not walk through.
+_ATOMIC_TYPES = {str, bytes, int, float, complex, bool, type(None), range}
+_BY_REFERENCE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+# Per-process caches stored on the context dict; never written to the state file.
+_TRANSIENT_CONTEXT_KEYS = ("_line_offsets", "_content_id")
+
 
 class RlmReplError(RuntimeError):
     pass
@@ -76,37 +166,377 @@ def _ensure_parent_dir(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
-def _load_state(state_path: Path) -> Dict[str, Any]:
-    if not state_path.exists():
+def _write_atomic(path: Path, *chunks: Any) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with tmp_path.open("wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    tmp_path.replace(path)
+
+
+def _dump_value(value: Any) -> List[Any]:
+    """Pickle value into chunks to write: the pickle stream, then any
+    out-of-band buffers as length-prefixed raw memory (no copy into the stream)."""
+    if _OOB_SUPPORTED:
+        buffers: List[pickle.PickleBuffer] = []
+        data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        if buffers:
+            try:
+                raws = [b.raw() for b in buffers]
+            except BufferError:  # non-contiguous buffer: keep everything in-band
+                return [pickle.dumps(value, protocol=5)]
+            else:
+                chunks: List[Any] = [_OOB_MAGIC, struct.pack("<Q", len(data)), data]
+                for raw in raws:
+                    chunks.append(struct.pack("<Q", raw.nbytes))
+                    chunks.append(raw)
+                return chunks
+        return [data]
+    return [pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)]
+
+
+def _load_value(path: Path) -> Any:
+    """Inverse of _dump_value."""
+    with path.open("rb") as f:
+        if f.read(len(_OOB_MAGIC)) != _OOB_MAGIC:
+            f.seek(0)
+            return pickle.load(f)
+        # Read into one writable buffer so reconstructed objects (e.g. numpy
+        # arrays) can share its memory and stay writable.
+        buf = bytearray(os.fstat(f.fileno()).st_size - len(_OOB_MAGIC))
+        f.readinto(buf)
+    view = memoryview(buf)
+    (n,) = struct.unpack_from("<Q", view, 0)
+    data, pos = view[8:8 + n], 8 + n
+    buffers = []
+    while pos < len(view):
+        (n,) = struct.unpack_from("<Q", view, pos)
+        buffers.append(view[pos + 8:pos + 8 + n])
+        pos += 8 + n
+    return pickle.loads(data, buffers=buffers)
+
+
+def _has_mutable_state(obj: Any) -> bool:
+    """Whether two variables reaching obj must keep sharing it after a reload.
+
+    Classes, functions and other objects pickled by reference are excluded, so
+    instances of the same class are not tied together through it.
+    """
+    if isinstance(obj, (list, dict, set, bytearray)):
+        return True
+    if isinstance(obj, _BY_REFERENCE_TYPES):
+        return False
+    if hasattr(obj, "__dict__"):
+        return True
+    try:
+        return not memoryview(obj).readonly  # e.g. numpy arrays
+    except TypeError:
+        return False
+
+
+def _mutable_objects(value: Any) -> Dict[int, Any]:
+    """Objects with mutable state reachable from value, by id.
+
+    Walks gc referents instead of pickling, so no __reduce__ runs; classes,
+    modules and functions are not entered.
+    """
+    seen: Dict[int, Any] = {}
+    frontier = [value]
+    while frontier:
+        expand = []
+        for obj in frontier:
+            if type(obj) in _ATOMIC_TYPES or id(obj) in seen or isinstance(obj, _BY_REFERENCE_TYPES):
+                continue
+            seen[id(obj)] = obj
+            expand.append(obj)
+        frontier = gc.get_referents(*expand) if expand else []
+    return {k: obj for k, obj in seen.items() if _has_mutable_state(obj)}
+
+
+class _LazyGlobals(MutableMapping):
+    """Persisted globals, unpickled on first access.
+
+    Each file holds a {name: value} group pickled together; names whose values
+    share mutable objects go into the same group so aliasing survives a reload,
+    everything else gets a file of its own. An index maps names to files.
+    Assignments and deletions are only recorded; save() rewrites just the groups
+    they touch, so variables an exec never uses are neither unpickled nor rewritten.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._files: Dict[str, str] = {}
+        index = directory / GLOBALS_INDEX
+        if index.exists():
+            with index.open("rb") as f:
+                self._files = pickle.load(f)
+        self._names: Set[str] = set(self._files)
+        self._values: Dict[str, Any] = {}
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+
+    def _load_group(self, filename: str, name: str) -> None:
+        try:
+            group = _load_value(self.directory / filename)
+        except Exception as e:
+            raise RlmReplError(
+                f"Cannot load persisted variable {name!r} from {self.directory / filename}: "
+                f"{type(e).__name__}: {e}"
+            ) from e
+        for name, value in group.items():
+            # Skip members since rebound, deleted or moved to another group.
+            if (
+                name in self._names
+                and name not in self._values
+                and self._files.get(name) == filename
+            ):
+                self._values[name] = value
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._names:
+            raise KeyError(name)
+        if name not in self._values:
+            self._load_group(self._files[name], name)
+        return self._values[name]
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        self._names.add(name)
+        self._values[name] = value
+        self._dirty.add(name)
+        self._deleted.discard(name)
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self._names:
+            raise KeyError(name)
+        self._names.discard(name)
+        self._values.pop(name, None)
+        self._dirty.discard(name)
+        self._deleted.add(name)
+
+    def __contains__(self, name: object) -> bool:
+        # MutableMapping's version would unpickle the value just to test membership.
+        return name in self._names
+
+    def clear(self) -> None:
+        # MutableMapping.clear() pops (and so unpickles) every value; drop names only.
+        self._deleted |= self._names
+        self._names.clear()
+        self._values.clear()
+        self._dirty.clear()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted(self._names))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _shared_groups(self, names: List[str]) -> List[List[str]]:
+        """Split names into groups of variables that share mutable objects.
+
+        Loaded mutable values are always saved, so sharing can only exist among
+        the names being saved; with a single name there is nothing to walk.
+        """
+        values = {name: self[name] for name in names}
+        if len(names) < 2:
+            return [list(names)] if names else []
+        owner: Dict[int, str] = {}  # id of a mutable object -> first name reaching it
+        parent = {name: name for name in names}  # union-find over names
+
+        def find(name: str) -> str:
+            while parent[name] != name:
+                name = parent[name]
+            return name
+
+        for name in names:
+            for obj_id in _mutable_objects(values[name]):
+                other = owner.setdefault(obj_id, name)
+                if other != name:
+                    parent[find(name)] = find(other)
+        groups: Dict[str, List[str]] = {}
+        for name in names:
+            groups.setdefault(find(name), []).append(name)
+        return list(groups.values())
+
+    def save(self) -> List[str]:
+        """Rewrite the groups holding assigned or deleted names.
+
+        Values that cannot be pickled are dropped and their names returned.
+        """
+        touched = {
+            self._files[name] for name in self._dirty | self._deleted if name in self._files
+        }
+        if not touched and not self._dirty:
+            return []
+        # Untouched members of a touched group are rewritten with it, so they
+        # can be regrouped with whatever they still share objects with.
+        pending = sorted(self._dirty | {
+            name for name in self._names if self._files.get(name) in touched
+        })
+        dropped: List[str] = []
+        written: Set[str] = set()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for members in self._shared_groups(pending):
+            try:
+                chunks = _dump_value({name: self._values[name] for name in members})
+            except Exception:
+                # Only on failure is each member pickled alone, to find the culprits.
+                for name in list(members):
+                    try:
+                        _dump_value(self._values[name])
+                    except Exception:
+                        dropped.append(name)
+                        members.remove(name)
+                        del self[name]
+                if not members:
+                    continue
+                chunks = _dump_value({name: self._values[name] for name in members})
+            filename = f"{min(members).encode('utf-8').hex()}.pkl"
+            _write_atomic(self.directory / filename, *chunks)
+            written.add(filename)
+            for name in members:
+                self._files[name] = filename
+
+        for name in self._deleted:
+            self._files.pop(name, None)
+        _write_atomic(
+            self.directory / GLOBALS_INDEX,
+            pickle.dumps(self._files, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+        for filename in touched - written:
+            try:
+                (self.directory / filename).unlink()
+            except FileNotFoundError:
+                pass
+        self._dirty.clear()
+        self._deleted.clear()
+        return dropped
+
+
+def _write_content(content: str | bytes, path: Path) -> None:
+    """Write content raw: bytes as-is, str as UTF-8 (lone surrogates survive)."""
+    if _is_bytes(content):
+        _write_atomic(path, content)
+    elif isinstance(content, str):
+        _write_atomic(path, content.encode("utf-8", errors="surrogatepass"))
+    else:
         raise RlmReplError(
-            f"No state found at {state_path}. Run: python rlm_repl.py init <context_path>"
+            f"context['content'] must be str or bytes, not {type(content).__name__}"
         )
-    with state_path.open("rb") as f:
-        state = pickle.load(f)
-    if not isinstance(state, dict):
-        raise RlmReplError(f"Corrupt state file: {state_path}")
-    return state
 
 
-def _save_state(state: Dict[str, Any], state_path: Path) -> None:
-    _ensure_parent_dir(state_path)
-    tmp_path = state_path.with_suffix(state_path.suffix + ".tmp")
-    with tmp_path.open("wb") as f:
-        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
-    tmp_path.replace(state_path)
+def _read_content(path: Path, as_bytes: bool = False) -> str | bytes:
+    """Read the content file through a read-only memory map, decoding unless as_bytes."""
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b"" if as_bytes else ""  # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if as_bytes:
+                return mm[:]
+            return str(mm, "utf-8", "surrogatepass")
 
 
-def _read_text_file(path: Path, max_bytes: int | None = None) -> str:
+def _check_state_dir(state_dir: Path) -> None:
+    if state_dir.is_file():
+        raise RlmReplError(
+            f"{state_dir} is a state file from an older rlm_repl; --state now names a "
+            f"directory. Run 'reset' on it, then init again with a directory "
+            f"(default: {DEFAULT_STATE_DIR})."
+        )
+
+
+def _load_state(state_dir: Path, load_content: bool = True) -> Dict[str, Any]:
+    """Load runtime state and, unless load_content is False, the context content."""
+    _check_state_dir(state_dir)
+    runtime_path = state_dir / RUNTIME_FILE
+    if not runtime_path.exists():
+        hint = ""
+        if (state_dir / LEGACY_STATE_FILE).exists():
+            hint = f" ({state_dir / LEGACY_STATE_FILE} is from an older rlm_repl and cannot be loaded.)"
+        raise RlmReplError(
+            f"No state found at {state_dir}. Run: python rlm_repl.py init <context_path>{hint}"
+        )
+    with runtime_path.open("rb") as f:
+        state = pickle.load(f)
+    if not isinstance(state, dict) or not isinstance(state.get("context"), dict):
+        raise RlmReplError(f"Corrupt state file: {runtime_path}")
+    state["globals"] = _LazyGlobals(state_dir / GLOBALS_DIR)
+    if load_content:
+        content_path = state_dir / CONTENT_FILE
+        if not content_path.exists():
+            raise RlmReplError(f"Corrupt state, missing content: {content_path}")
+        content = _read_content(content_path, as_bytes=state.get("content_is_bytes", False))
+        state["context"]["content"] = content
+        # The saved stats belong to this content (see _dump_runtime); key them to it.
+        if "_stats_cache" in state["context"]:
+            state["context"]["_stats_cache"] = (
+                (id(content), len(content)), state["context"]["_stats_cache"]
+            )
+    return state
+
+
+def _dump_runtime(state: Dict[str, Any]) -> bytes:
+    """Pickle everything in state except the content and the persisted globals."""
+    ctx = state.get("context") or {}
+    runtime_ctx = {
+        k: v for k, v in ctx.items()
+        if k != "content" and k not in _TRANSIENT_CONTEXT_KEYS
+    }
+    # Keep the stats cache only if it was computed for the content being saved.
+    content = ctx.get("content", "")
+    stats_cache = runtime_ctx.pop("_stats_cache", None)
+    if stats_cache and stats_cache[0] == (id(content), len(content)):
+        runtime_ctx["_stats_cache"] = stats_cache[1]
+    runtime = {k: v for k, v in state.items() if k != "globals"}
+    runtime["context"] = runtime_ctx
+    runtime["content_is_bytes"] = _is_bytes(ctx.get("content", ""))
+    return pickle.dumps(runtime, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _save_state(
+    state: Dict[str, Any],
+    state_dir: Path,
+    save_content: bool = True,
+    runtime_before: Optional[bytes] = None,
+) -> List[str]:
+    """Write runtime state; rewrite the content file only when save_content is set.
+
+    The runtime file is left alone when it would be identical to runtime_before.
+    A plain dict in state['globals'] (as built by init) replaces every persisted
+    variable; a _LazyGlobals only writes the names assigned or deleted on it.
+    Returns the names of globals that were dropped because they cannot be pickled.
+    """
+    _check_state_dir(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    ctx = state.get("context") or {}
+    if save_content:
+        _write_content(ctx.get("content", ""), state_dir / CONTENT_FILE)
+    runtime = _dump_runtime(state)
+    if runtime != runtime_before:
+        _write_atomic(state_dir / RUNTIME_FILE, runtime)
+
+    persisted = state.get("globals")
+    if not isinstance(persisted, _LazyGlobals):
+        fresh = _LazyGlobals(state_dir / GLOBALS_DIR)
+        fresh.clear()
+        fresh.update(persisted or {})
+        persisted = fresh
+        # init replaces all state, including any left by an older version.
+        (state_dir / LEGACY_STATE_FILE).unlink(missing_ok=True)
+    return persisted.save()
+
+
+def _read_bytes_file(path: Path, max_bytes: int | None = None) -> bytes:
     if not path.exists():
         raise RlmReplError(f"Context file does not exist: {path}")
-    data: bytes
     with path.open("rb") as f:
-        data = f.read() if max_bytes is None else f.read(max_bytes)
-    try:
-        return data.decode("utf-8")
-    except UnicodeDecodeError:
-        # Fall back to a lossy decode that will not crash.
-        return data.decode("utf-8", errors="replace")
+        return f.read() if max_bytes is None else f.read(max_bytes)
+
+
+def _read_text_file(path: Path, max_bytes: int | None = None) -> str:
+    data = _read_bytes_file(path, max_bytes=max_bytes)
+    # A single lossy decode: identical to a strict one for valid UTF-8, and it
+    # never has to decode the data a second time when the file is not.
+    return data.decode("utf-8", errors="replace")
 
 
 def _truncate(s: str, max_chars: int) -> str:
@@ -117,32 +547,287 @@ def _truncate(s: str, max_chars: int) -> str:
     return s[:max_chars] + f"\n... [truncated to {max_chars} chars] ...\n"
 
 
-def _is_pickleable(value: Any) -> bool:
+def _compile_cached(code: str, cache_dir: Path) -> types.CodeType:
+    """Compile exec'd source, reusing marshalled bytecode cached by source hash.
+
+    Only sources of at least CODE_CACHE_MIN_CHARS are cached, and only the
+    CODE_CACHE_MAX_ENTRIES most recently used entries are kept.
+    """
+    if len(code) < CODE_CACHE_MIN_CHARS:
+        return compile(code, "<string>", "exec")
+    # marshal output is only valid for the interpreter (and -O level) that wrote it.
+    key = hashlib.sha256(
+        f"{sys.version}|{sys.flags.optimize}|".encode()
+        + code.encode("utf-8", errors="surrogatepass")
+    ).hexdigest()
+    path = cache_dir / f"{key}.marshal"
     try:
-        pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
-        return True
-    except Exception:
-        return False
+        compiled = marshal.loads(path.read_bytes())
+        if isinstance(compiled, types.CodeType):
+            os.utime(path)  # mark as recently used for pruning
+            return compiled
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+    compiled = compile(code, "<string>", "exec")
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        _write_atomic(path, marshal.dumps(compiled))
+        _prune_code_cache(cache_dir)
+    except OSError:
+        pass  # the cache is best-effort
+    return compiled
+
+
+def _prune_code_cache(cache_dir: Path) -> None:
+    """Delete all but the CODE_CACHE_MAX_ENTRIES most recently used cache entries."""
+    entries = [e for e in os.scandir(cache_dir) if e.name.endswith(".marshal")]
+    if len(entries) <= CODE_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[CODE_CACHE_MAX_ENTRIES:]:
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def _referenced_names(code: types.CodeType) -> Set[str]:
+    """Collect every global/attribute name used by code and its nested code objects."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """Import numpy on first use; None when it is not installed."""
+    try:
+        import numpy
+    except ImportError:  # numpy is optional; pure-Python fallbacks are used instead.
+        return None
+    return numpy
+
+
+@lru_cache(maxsize=256)
+def _compiled(pattern: str | bytes, flags: int = 0) -> "re.Pattern":
+    """Compile a regex once per (pattern, flags) and reuse it across helper calls."""
+    return re.compile(pattern, flags)
+
+
+def _is_bytes(content: Any) -> bool:
+    return isinstance(content, (bytes, bytearray))
+
 
+def _to_str(value: Any) -> Any:
+    """Decode a slice of bytes-mode content for display; str passes through."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
 
-def _filter_pickleable(d: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
-    kept: Dict[str, Any] = {}
-    dropped: List[str] = []
-    for k, v in d.items():
-        if _is_pickleable(v):
-            kept[k] = v
+
+def _regex(pattern: Any, content: Any, flags: int = 0) -> "re.Pattern":
+    """Return pattern compiled as a str or bytes regex, whichever content needs."""
+    want_bytes = _is_bytes(content)
+    if isinstance(pattern, re.Pattern):
+        if isinstance(pattern.pattern, bytes) == want_bytes and not flags:
+            return pattern
+        flags |= pattern.flags
+        pattern = pattern.pattern
+    if want_bytes and isinstance(pattern, str):
+        pattern = pattern.encode("utf-8")
+        flags &= ~re.UNICODE
+    elif not want_bytes and isinstance(pattern, bytes):
+        pattern = pattern.decode("utf-8")
+    return _compiled(pattern, flags)
+
+
+@lru_cache(maxsize=None)
+def _hyperscan():
+    """Import hyperscan on first use; None when it is not installed."""
+    try:
+        import hyperscan
+    except ImportError:  # hyperscan is optional; grep_many falls back to re.
+        return None
+    return hyperscan
+
+
+@lru_cache(maxsize=32)
+def _hyperscan_db(patterns: Tuple[bytes, ...], flags: int):
+    """Compile patterns into one Hyperscan database, reporting leftmost match starts."""
+    hyperscan = _hyperscan()
+    hs_flags = hyperscan.HS_FLAG_SOM_LEFTMOST
+    if flags & re.IGNORECASE:
+        hs_flags |= hyperscan.HS_FLAG_CASELESS
+    if flags & re.MULTILINE:
+        hs_flags |= hyperscan.HS_FLAG_MULTILINE
+    if flags & re.DOTALL:
+        hs_flags |= hyperscan.HS_FLAG_DOTALL
+    db = hyperscan.Database()
+    db.compile(
+        expressions=list(patterns),
+        ids=list(range(len(patterns))),
+        elements=len(patterns),
+        flags=[hs_flags] * len(patterns),
+    )
+    return db
+
+
+def _hyperscan_spans(
+    patterns: List[str], content: str | bytes, flags: int, max_matches: int
+) -> Optional[List[List[Tuple[int, int]]]]:
+    """Scan content once for all patterns; None when Hyperscan cannot be used.
+
+    Hyperscan works on bytes, so str content is only scanned when it is ASCII
+    (byte offsets are then character offsets). Patterns it cannot compile
+    (backreferences, lookarounds, ...), patterns that are not plain str, and
+    flags other than I/M/S also return None.
+    """
+    if not patterns or flags & ~_HYPERSCAN_FLAGS:
+        return None
+    if not all(isinstance(p, str) for p in patterns):
+        return None
+    hyperscan = _hyperscan()
+    if hyperscan is None:
+        return None
+    if _is_bytes(content):
+        data = bytes(content)
+    elif content.isascii():
+        data = content.encode("ascii")
+    else:
+        return None
+    try:
+        db = _hyperscan_db(tuple(p.encode("utf-8") for p in patterns), flags)
+    except hyperscan.error:
+        return None
+
+    spans: List[List[Tuple[int, int]]] = [[] for _ in patterns]
+
+    def on_match(pattern_id: int, start: int, end: int, _flags: int, _ctx: Any) -> None:
+        # Hyperscan reports every match end in increasing order: a repeat start
+        # extends the previous span (greedy, like re), otherwise keep only
+        # non-overlapping matches.
+        found = spans[pattern_id]
+        if found and start == found[-1][0]:
+            found[-1] = (start, end)
+        elif len(found) < max_matches and (not found or start >= found[-1][1]):
+            found.append((start, end))
+
+    db.scan(data, match_event_handler=on_match)
+    return spans
+
+
+def _count_lines(content: str | bytes) -> int:
+    """Count lines without materialising them (a trailing newline ends the last line)."""
+    if not content:
+        return 0
+    nl = b"\n" if _is_bytes(content) else "\n"
+    return content.count(nl) + (0 if content.endswith(nl) else 1)
+
+
+def _json_loads(text: str | bytes) -> Any:
+    """Parse JSON with orjson when available, else with the stdlib parser.
+
+    orjson rejects some documents json accepts (e.g. NaN/Infinity), so those
+    are retried with json before being treated as invalid.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def _iter_lines(content: str | bytes):
+    """Yield lines lazily (without their newline) so callers can stop early."""
+    i, n = 0, len(content)
+    nl = b"\n" if _is_bytes(content) else "\n"
+    find = content.find
+    while i < n:
+        j = find(nl, i)
+        if j < 0:
+            j = n
+        yield content[i:j]
+        i = j + 1
+
+
+# Line-start kernels, compiled with numba by _newline_kernels().
+def _count_newlines(buf) -> int:
+    count = 0
+    for i in range(len(buf)):
+        if buf[i] == 10:
+            count += 1
+    return count
+
+
+def _fill_line_starts(buf, out) -> None:
+    """Write the line start offsets of a uint8 buffer into out (sized by _count_newlines)."""
+    out[0] = 0
+    k = 1
+    for i in range(len(buf)):
+        if buf[i] == 10:
+            out[k] = i + 1
+            k += 1
+
+
+@lru_cache(maxsize=None)
+def _newline_kernels():
+    """Import numba and jit the line-start kernels (cached on disk); None without numba."""
+    try:
+        from numba import njit
+    except ImportError:  # numba is optional; numpy scans for newlines instead.
+        return None
+    return njit(cache=True)(_count_newlines), njit(cache=True)(_fill_line_starts)
+
+
+def _build_line_offsets(content: str | bytes) -> List[int]:
+    """Return the start offset of every line in content (first entry is 0)."""
+    np = None
+    if len(content) >= _NUMPY_MIN_CHARS and (_is_bytes(content) or content.isascii()):
+        np = _numpy()
+    if np is not None:
+        data = content if _is_bytes(content) else content.encode("ascii")
+        buf = np.frombuffer(data, dtype=np.uint8)
+        kernels = _newline_kernels() if len(content) >= _NUMBA_MIN_CHARS else None
+        if kernels is not None:
+            count_newlines, fill_line_starts = kernels
+            starts = np.empty(count_newlines(buf) + 1, dtype=np.int64)
+            fill_line_starts(buf, starts)
         else:
-            dropped.append(k)
-    return kept, dropped
+            starts = np.concatenate(([0], np.flatnonzero(buf == 0x0A) + 1))
+        offsets = starts.tolist()
+    else:
+        nl = b"\n" if _is_bytes(content) else "\n"
+        offsets = [0]
+        find = content.find
+        i = find(nl)
+        while i != -1:
+            offsets.append(i + 1)
+            i = find(nl, i + 1)
+    if len(offsets) > 1 and offsets[-1] == len(content):
+        offsets.pop()  # a trailing newline does not start another line
+    return offsets
+
+
+def _get_line_offsets(ctx: Dict[str, Any]) -> List[int]:
+    """Return line start offsets for ctx['content'], cached on ctx until content changes."""
+    content = ctx.get("content", "")
+    key = (id(content), len(content))
+    if ctx.get("_content_id") != key or "_line_offsets" not in ctx:
+        ctx["_line_offsets"] = _build_line_offsets(content)
+        ctx["_content_id"] = key
+    return ctx["_line_offsets"]
 
 
 def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
     """Create helper functions that close over context_ref/buffers_ref."""
     
     def peek(start: int = 0, end: int = 1000) -> str:
-        """Return a slice of the content."""
+        """Return a slice of the content (bytes content is decoded slice-wise)."""
         content = context_ref.get("content", "")
-        return content[start:end]
+        return _to_str(content[start:end])
 
     def grep(
         pattern: str,
@@ -153,43 +838,69 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
         """Search for pattern in content, return matches with surrounding context window."""
         content = context_ref.get("content", "")
         out: List[Dict[str, Any]] = []
-        lines = content.splitlines()
-        line_offsets: List[int] = []
-        offset = 0
-        for line in lines:
-            line_offsets.append(offset)
-            offset += len(line) + 1  # +1 for newline
-
-        def _offset_to_line(pos: int) -> int:
-            lo, hi = 0, len(line_offsets) - 1
-            while lo <= hi:
-                mid = (lo + hi) // 2
-                if line_offsets[mid] <= pos:
-                    lo = mid + 1
-                else:
-                    hi = mid - 1
-            return hi + 1  # 1-indexed
+        line_offsets = None
 
-        for m in re.finditer(pattern, content, flags):
+        for m in _regex(pattern, content, flags).finditer(content):
             start, end = m.span()
             snippet_start = max(0, start - window)
             snippet_end = min(len(content), end + window)
+            if line_offsets is None:
+                line_offsets = _get_line_offsets(context_ref)
             out.append(
                 {
-                    "match": m.group(0),
+                    "match": _to_str(m.group(0)),
                     "span": (start, end),
-                    "line": _offset_to_line(start),
-                    "snippet": content[snippet_start:snippet_end],
+                    "line": bisect.bisect_right(line_offsets, start),  # 1-indexed
+                    "snippet": _to_str(content[snippet_start:snippet_end]),
                 }
             )
             if len(out) >= max_matches:
                 break
         return out
 
+    def grep_many(
+        patterns: List[str],
+        max_matches: int = 20,
+        flags: int = 0,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Search for several patterns at once, return {pattern: matches}.
+
+        With the optional hyperscan package installed, all patterns are matched
+        in a single linear-time pass over the content; otherwise (or for
+        patterns Hyperscan cannot compile) each pattern is searched with re.
+        Hyperscan spans can differ from re's for lazy or alternation patterns.
+        """
+        content = context_ref.get("content", "")
+        patterns = list(patterns)
+        spans = _hyperscan_spans(patterns, content, flags, max_matches)
+        if spans is None:
+            spans = []
+            for pattern in patterns:
+                found: List[Tuple[int, int]] = []
+                if max_matches > 0:
+                    for m in _regex(pattern, content, flags).finditer(content):
+                        found.append(m.span())
+                        if len(found) >= max_matches:
+                            break
+                spans.append(found)
+
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        line_offsets = _get_line_offsets(context_ref) if any(spans) else []
+        for pattern, found in zip(patterns, spans):
+            out[pattern] = [
+                {
+                    "match": _to_str(content[start:end]),
+                    "span": (start, end),
+                    "line": bisect.bisect_right(line_offsets, start),  # 1-indexed
+                }
+                for start, end in found
+            ]
+        return out
+
     def grep_count(pattern: str, flags: int = 0) -> int:
         """Count occurrences of pattern in content."""
         content = context_ref.get("content", "")
-        return len(re.findall(pattern, content, flags))
+        return sum(1 for _ in _regex(pattern, content, flags).finditer(content))
 
     def find_lines(
         pattern: str,
@@ -198,17 +909,60 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
     ) -> List[Dict[str, Any]]:
         """Find lines matching pattern, return with line numbers."""
         content = context_ref.get("content", "")
-        lines = content.splitlines()
         out: List[Dict[str, Any]] = []
-        regex = re.compile(pattern, flags)
-        for i, line in enumerate(lines, 1):
-            if regex.search(line):
-                out.append({
-                    "line_number": i,
-                    "content": line,
-                })
-                if len(out) >= max_matches:
+        if not content:
+            return out
+        regex = _regex(pattern, content, flags | re.MULTILINE)
+        line_offsets = _get_line_offsets(context_ref)
+        n_lines = len(line_offsets)
+        n = len(content)
+        nl, cr = (b"\n", b"\r") if _is_bytes(content) else ("\n", "\r")
+
+        def _line_end(idx: int) -> int:
+            end = line_offsets[idx + 1] - 1 if idx + 1 < n_lines else n
+            if end > line_offsets[idx] and content[end - 1:end] == nl:
+                end -= 1
+            if end > line_offsets[idx] and content[end - 1:end] == cr:
+                end -= 1
+            return end
+
+        def _emit(idx: int, line_end: int) -> bool:
+            out.append({
+                "line_number": idx + 1,
+                "content": _to_str(content[line_offsets[idx]:line_end]),
+            })
+            return len(out) >= max_matches
+
+        # \A and \Z must match at every line's start and end, as for a lone line.
+        anchors = (b"\\A", b"\\Z") if _is_bytes(regex.pattern) else ("\\A", "\\Z")
+        anchored = any(anchor in regex.pattern for anchor in anchors)
+        if anchored or cr in content:
+            # `$` must also match before "\r\n", so test each line within its own
+            # bounds; anchored patterns search a slice, since pos does not move \A.
+            for idx in range(n_lines):
+                line_end = _line_end(idx)
+                if anchored:
+                    hit = regex.search(content[line_offsets[idx]:line_end])
+                else:
+                    hit = regex.search(content, line_offsets[idx], line_end)
+                if hit and _emit(idx, line_end):
                     break
+            return out
+
+        pos = 0
+        while True:
+            m = regex.search(content, pos)
+            if m is None:
+                break
+            idx = bisect.bisect_right(line_offsets, m.start()) - 1
+            line_end = _line_end(idx)
+            # A match may run past the end of its line; re-check within the line only.
+            if m.end() <= line_end or regex.search(content, line_offsets[idx], line_end):
+                if _emit(idx, line_end):
+                    break
+            if idx + 1 >= n_lines:
+                break
+            pos = line_offsets[idx + 1]
         return out
 
     def chunk_indices(size: int = 200_000, overlap: int = 0) -> List[Tuple[int, int]]:
@@ -224,6 +978,13 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
         n = len(content)
         spans: List[Tuple[int, int]] = []
         step = size - overlap
+        # The last chunk is the first one that reaches the end of the content.
+        count = max(0, -(-(n - size) // step)) + 1 if n else 0
+        np = _numpy() if count >= _NUMPY_MIN_SPANS else None
+        if np is not None:
+            starts = np.arange(count, dtype=np.int64) * step
+            ends = np.minimum(starts + size, n)
+            return list(zip(starts.tolist(), ends.tolist()))
         for start in range(0, n, step):
             end = min(n, start + size)
             spans.append((start, end))
@@ -243,12 +1004,31 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
         spans = chunk_indices(size=size, overlap=overlap)
         out_path = Path(out_dir)
         out_path.mkdir(parents=True, exist_ok=True)
-        paths: List[str] = []
-        for i, (s, e) in enumerate(spans):
+        if not spans:
+            return []
+
+        # Encode once and slice bytes when character and byte offsets agree
+        # (bytes content, or text whose encoding is one byte per character).
+        data: Optional[memoryview] = None
+        if _is_bytes(content):
+            data = memoryview(content)
+        elif content.isascii():
+            encoded = content.encode(encoding)
+            if len(encoded) == len(content):
+                data = memoryview(encoded)
+
+        def _write_one(i: int, span: Tuple[int, int]) -> str:
+            s, e = span
             p = out_path / f"{prefix}_{i:04d}.txt"
-            p.write_text(content[s:e], encoding=encoding)
-            paths.append(str(p))
-        return paths
+            if data is not None:
+                p.write_bytes(data[s:e])
+            else:
+                p.write_text(content[s:e], encoding=encoding)
+            return str(p)
+
+        workers = min(_MAX_WRITE_WORKERS, len(spans))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_write_one, range(len(spans)), spans))
 
     def add_buffer(text: str) -> None:
         """Add text to the buffers list for later synthesis."""
@@ -259,62 +1039,82 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
         content = context_ref.get("content", "")
         objects: List[Dict[str, Any]] = []
         # Try line-by-line first (JSONL format)
-        for line in content.splitlines():
+        open_brace, close_brace = (b"{", b"}") if _is_bytes(content) else ("{", "}")
+        for line in _iter_lines(content):
             line = line.strip()
-            if line.startswith("{"):
+            # A JSON object must also end with "}"; checking that first skips the
+            # parse-and-raise path for truncated or wrapped lines.
+            if line.startswith(open_brace) and line.endswith(close_brace):
                 try:
-                    obj = json.loads(line)
+                    obj = _json_loads(line)
                     objects.append(obj)
                     if len(objects) >= max_objects:
                         break
-                except json.JSONDecodeError:
+                except ValueError:  # JSONDecodeError, or invalid UTF-8 in bytes mode
                     continue
         return objects
 
     def extract_yaml_documents(max_docs: int = 50) -> List[str]:
         """Split YAML content into documents (separated by ---)."""
         content = context_ref.get("content", "")
-        docs = re.split(r'^---\s*$', content, flags=re.MULTILINE)
-        return [d.strip() for d in docs[:max_docs] if d.strip()]
+        docs = _regex(_YAML_DOC_SEP, content).split(content)
+        return [_to_str(d.strip()) for d in docs[:max_docs] if d.strip()]
 
     def time_range() -> Dict[str, Optional[str]]:
         """Try to extract time range from log content."""
         content = context_ref.get("content", "")
-        # Common timestamp patterns
-        patterns = [
-            r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}',  # ISO format
-            r'\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}',    # Apache format
-            r'\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}',    # Syslog format
-        ]
-        
         first_ts = None
         last_ts = None
         
-        for pattern in patterns:
-            matches = re.findall(pattern, content)
-            if matches:
-                first_ts = matches[0]
-                last_ts = matches[-1]
-                break
+        for pattern in _TS_PATTERNS:
+            pattern = _regex(pattern, content)
+            first = pattern.search(content)
+            if first is None:
+                continue
+            last = None
+            tail_start = len(content) - _TS_TAIL_WINDOW
+            if tail_start > first.end():
+                for last in pattern.finditer(content, tail_start):
+                    pass
+                if last is not None and last.start() < tail_start + _TS_TAIL_MARGIN:
+                    last = None
+            if last is None:
+                # No reliable hit near the end: scan forward without keeping matches.
+                last = first
+                for last in pattern.finditer(content, first.end()):
+                    pass
+            first_ts = _to_str(first.group(0))
+            last_ts = _to_str(last.group(0))
+            break
         
         return {"first": first_ts, "last": last_ts}
 
     def stats() -> Dict[str, Any]:
         """Return basic statistics about the loaded content."""
         content = context_ref.get("content", "")
-        lines = content.splitlines()
-        non_empty = [l for l in lines if l.strip()]
+        # The full-content scans are cached on the context, keyed by the content
+        # object, and persist across exec calls until the content is replaced.
+        key = (id(content), len(content))
+        cached = context_ref.get("_stats_cache")
+        if cached and cached[0] == key:
+            total_lines, non_empty, error_count, warning_count = cached[1]
+        else:
+            total_lines = _count_lines(content)
+            non_empty = sum(1 for _ in _regex(_NON_EMPTY_LINE_RE, content).finditer(content))
+            error_count = sum(1 for _ in _regex(_ERR_RE, content).finditer(content))
+            warning_count = sum(1 for _ in _regex(_WARN_RE, content).finditer(content))
+            context_ref["_stats_cache"] = (
+                key, (total_lines, non_empty, error_count, warning_count)
+            )
         result: Dict[str, Any] = {
             "total_chars": len(content),
-            "total_lines": len(lines),
-            "non_empty_lines": len(non_empty),
-            "avg_line_length": len(content) // max(len(lines), 1),
+            "total_lines": total_lines,
+            "non_empty_lines": non_empty,
+            "avg_line_length": len(content) // max(total_lines, 1),
         }
         files = context_ref.get("files")
         if files:
             result["files_loaded"] = len(files)
-        error_count = len(re.findall(r'\b(ERROR|FATAL|CRITICAL)\b', content, re.I))
-        warning_count = len(re.findall(r'\bWARN(ING)?\b', content, re.I))
         if error_count or warning_count:
             result["error_count"] = error_count
             result["warning_count"] = warning_count
@@ -323,6 +1123,7 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
     return {
         "peek": peek,
         "grep": grep,
+        "grep_many": grep_many,
         "grep_count": grep_count,
         "find_lines": find_lines,
         "chunk_indices": chunk_indices,
@@ -335,19 +1136,89 @@ def _make_helpers(context_ref: Dict[str, Any], buffers_ref: List[str]):
     }
 
 
-def _should_exclude(path: Path, exclude_dirs: set) -> bool:
-    """Check if a path should be excluded based on directory names."""
-    for part in path.parts:
-        if part in exclude_dirs:
-            return True
-    return False
+def _glob_to_regex(pattern: str) -> "re.Pattern[str]":
+    """Translate a pathlib-style glob into a regex over '/'-joined relative paths.
+
+    ``**`` matches zero or more directories; ``*``, ``?`` and ``[...]`` never
+    match across a '/'.
+    """
+    segments = [seg for seg in pattern.split("/") if seg not in ("", ".")]
+    out: List[str] = []
+    for i, seg in enumerate(segments):
+        last = i == len(segments) - 1
+        if seg == "**":
+            out.append(".*" if last else "(?:[^/]*/)*")
+            continue
+        j = 0
+        while j < len(seg):
+            c = seg[j]
+            j += 1
+            if c == "*":
+                out.append("[^/]*")
+            elif c == "?":
+                out.append("[^/]")
+            elif c == "[":
+                k = j
+                if k < len(seg) and seg[k] == "!":
+                    k += 1
+                if k < len(seg) and seg[k] == "]":
+                    k += 1
+                k = seg.find("]", k)
+                if k < 0:
+                    out.append(re.escape(c))
+                    continue
+                body = seg[j:k]
+                j = k + 1
+                negate = body.startswith("!")
+                if negate:
+                    body = body[1:]
+                # Escape what is special in a regex class but literal in a glob
+                # (including a leading "]", which would otherwise close it).
+                body = re.sub(r"([\\\[\]^&~|])", r"\\\1", body)
+                out.append(f"[^/{body}]" if negate else f"[{body}]")
+            else:
+                out.append(re.escape(c))
+        if not last:
+            out.append("/")
+    return re.compile("".join(out) + r"\Z", re.DOTALL)
+
+
+def _walk(root: Path, exclude: set, pattern: str):
+    """Yield files under root whose relative path matches the glob pattern.
+
+    Directories named in exclude are pruned before they are entered, so large
+    ignored trees (.git, node_modules, ...) are never listed.
+    """
+    regex = _glob_to_regex(pattern)
+    stack = [(str(root), "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            it = os.scandir(dir_path)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name in exclude:
+                    continue
+                rel = rel_dir + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, rel + "/"))
+                    elif entry.is_file() and regex.match(rel):
+                        yield Path(entry.path)
+                except OSError:
+                    continue
 
 
 def cmd_init(args: argparse.Namespace) -> int:
-    state_path = Path(args.state)
+    state_dir = Path(args.state)
     ctx_path = Path(args.context)
 
-    content = _read_text_file(ctx_path, max_bytes=args.max_bytes)
+    if args.as_bytes:
+        content = _read_bytes_file(ctx_path, max_bytes=args.max_bytes)
+    else:
+        content = _read_text_file(ctx_path, max_bytes=args.max_bytes)
     state: Dict[str, Any] = {
         "version": 1,
         "context": {
@@ -358,16 +1229,17 @@ def cmd_init(args: argparse.Namespace) -> int:
         "buffers": [],
         "globals": {},
     }
-    _save_state(state, state_path)
+    _save_state(state, state_dir)
 
-    print(f"Initialized RLM REPL state at: {state_path}")
-    print(f"Loaded context: {ctx_path} ({len(content):,} chars)")
+    print(f"Initialized RLM REPL state at: {state_dir}")
+    unit = "bytes" if args.as_bytes else "chars"
+    print(f"Loaded context: {ctx_path} ({len(content):,} {unit})")
     return 0
 
 
 def cmd_init_dir(args: argparse.Namespace) -> int:
     """Load all matching files from a directory tree into a single context."""
-    state_path = Path(args.state)
+    state_dir = Path(args.state)
     root = Path(args.directory)
 
     if not root.is_dir():
@@ -381,29 +1253,35 @@ def cmd_init_dir(args: argparse.Namespace) -> int:
     max_bytes = args.max_bytes
 
     files_loaded: List[str] = []
-    parts: List[str] = []
+    # Stream files into one buffer instead of joining a list of per-file strings,
+    # which would hold the parts and the joined copy in memory at the same time.
+    buf = io.BytesIO() if args.as_bytes else io.StringIO()
     total_bytes = 0
 
-    for path in sorted(root.glob(pattern)):
-        if not path.is_file():
-            continue
-        if _should_exclude(path, exclude):
-            continue
+    # Only the final file list is sorted, matching the old sorted(root.glob()) order.
+    for path in sorted(_walk(root, exclude, pattern)):
+        if max_bytes and total_bytes >= max_bytes:
+            break
         try:
-            text = _read_text_file(path, max_bytes=None)
+            size = path.stat().st_size
+            if args.as_bytes:
+                text = _read_bytes_file(path, max_bytes=None)
+            else:
+                text = _read_text_file(path, max_bytes=None)
         except Exception:
             continue
-        header = f"{'=' * 60}\n# FILE: {path}\n{'=' * 60}\n"
-        parts.append(header + text)
+        sep = "\n\n" if files_loaded else ""
+        header = f"{sep}{'=' * 60}\n# FILE: {path}\n{'=' * 60}\n"
+        buf.write(header.encode("utf-8", errors="surrogateescape") if args.as_bytes else header)
+        buf.write(text)
         files_loaded.append(str(path))
-        total_bytes += len(text)
-        if max_bytes and total_bytes >= max_bytes:
-            break
+        total_bytes += size
 
-    if not parts:
+    if not files_loaded:
         raise RlmReplError(f"No files matched pattern '{pattern}' in {root}")
 
-    content = "\n\n".join(parts)
+    content = buf.getvalue()
+    buf.close()
     state: Dict[str, Any] = {
         "version": 1,
         "context": {
@@ -415,12 +1293,12 @@ def cmd_init_dir(args: argparse.Namespace) -> int:
         "buffers": [],
         "globals": {},
     }
-    _save_state(state, state_path)
+    _save_state(state, state_dir)
 
-    print(f"Initialized RLM REPL state at: {state_path}")
+    print(f"Initialized RLM REPL state at: {state_dir}")
     print(f"Loaded directory: {root}")
     print(f"  Files: {len(files_loaded)}")
-    print(f"  Total chars: {len(content):,}")
+    print(f"  Total {'bytes' if args.as_bytes else 'chars'}: {len(content):,}")
     print(f"  Excluded dirs: {', '.join(sorted(exclude))}")
     return 0
 
@@ -433,10 +1311,10 @@ def cmd_status(args: argparse.Namespace) -> int:
     g = state.get("globals", {})
 
     print("RLM REPL status")
-    print(f"  State file: {args.state}")
+    print(f"  State dir: {args.state}")
     print(f"  Context path: {ctx.get('path')}")
-    print(f"  Context chars: {len(content):,}")
-    print(f"  Context lines: {len(content.splitlines()):,}")
+    print(f"  Context {'bytes' if _is_bytes(content) else 'chars'}: {len(content):,}")
+    print(f"  Context lines: {_count_lines(content):,}")
     print(f"  Buffers: {len(buffers)}")
     print(f"  Persisted vars: {len(g)}")
     if args.show_vars and g:
@@ -445,25 +1323,46 @@ def cmd_status(args: argparse.Namespace) -> int:
     return 0
 
 
+def _reset_state_dir(state_dir: Path) -> None:
+    state_files = [
+        state_dir / name
+        for name in (CONTENT_FILE, RUNTIME_FILE, LEGACY_STATE_FILE)
+        if (state_dir / name).exists()
+    ]
+    state_dirs = [
+        state_dir / name
+        for name in (GLOBALS_DIR, CODE_CACHE_DIR)
+        if (state_dir / name).exists()
+    ]
+    if state_files or state_dirs:
+        for path in state_files:
+            path.unlink()
+        for path in state_dirs:
+            shutil.rmtree(path)
+        print(f"Deleted state: {state_dir}")
+    else:
+        print(f"No state to delete at: {state_dir}")
+
+
 def cmd_reset(args: argparse.Namespace) -> int:
-    state_path = Path(args.state)
-    if state_path.exists():
-        state_path.unlink()
-        print(f"Deleted state: {state_path}")
+    state_dir = Path(args.state)
+    chunks_dir = state_dir / "chunks"
+    if state_dir.is_file():  # --state pointing at an older version's state.pkl
+        state_dir.unlink()
+        print(f"Deleted state: {state_dir}")
+        chunks_dir = state_dir.parent / "chunks"
     else:
-        print(f"No state to delete at: {state_path}")
-    
+        _reset_state_dir(state_dir)
+
     # Also clean up chunks directory
-    chunks_dir = state_path.parent / "chunks"
     if chunks_dir.exists():
-        import shutil
         shutil.rmtree(chunks_dir)
         print(f"Deleted chunks directory: {chunks_dir}")
     return 0
 
 
 def cmd_export_buffers(args: argparse.Namespace) -> int:
-    state = _load_state(Path(args.state))
+    state = _load_state(Path(args.state), load_content=False)
     buffers = state.get("buffers", [])
     out_path = Path(args.out)
     _ensure_parent_dir(out_path)
@@ -473,8 +1372,8 @@ def cmd_export_buffers(args: argparse.Namespace) -> int:
 
 
 def cmd_exec(args: argparse.Namespace) -> int:
-    state_path = Path(args.state)
-    state = _load_state(state_path)
+    state_dir = Path(args.state)
+    state = _load_state(state_dir)
 
     ctx = state.get("context")
     if not isinstance(ctx, dict) or "content" not in ctx:
@@ -485,35 +1384,53 @@ def cmd_exec(args: argparse.Namespace) -> int:
         buffers = []
         state["buffers"] = buffers
 
-    persisted = state.setdefault("globals", {})
-    if not isinstance(persisted, dict):
-        persisted = {}
-        state["globals"] = persisted
+    persisted = state["globals"]
 
     code = args.code
     if code is None:
         code = sys.stdin.read()
 
-    # Build execution environment.
-    # Start from persisted variables, then inject context, buffers and helpers.
-    env: Dict[str, Any] = dict(persisted)
-    env["context"] = ctx
-    env["content"] = ctx.get("content", "")
-    env["buffers"] = buffers
-
-    helpers = _make_helpers(ctx, buffers)
-    env.update(helpers)
+    content_before = ctx.get("content")
+    # Read-only snippets (print(peek(...)), print(stats())) leave this unchanged,
+    # so the runtime file does not need rewriting.
+    runtime_before = _dump_runtime(state)
 
     # Capture output.
     stdout_buf = io.StringIO()
     stderr_buf = io.StringIO()
 
+    compiled = None
     try:
-        with redirect_stdout(stdout_buf), redirect_stderr(stderr_buf):
-            exec(code, env, env)
+        compiled = _compile_cached(code, state_dir / CODE_CACHE_DIR)
     except Exception:
         traceback.print_exc(file=stderr_buf)
 
+    # Build execution environment.
+    # Start from the persisted variables the code refers to (unpickling only
+    # those), then inject context, buffers and helpers.
+    env: Dict[str, Any] = {}
+    if compiled is not None:
+        names = _referenced_names(compiled)
+        if names & _DYNAMIC_NAME_ACCESS:
+            names = set(persisted)
+        for name in names:
+            if name in persisted:
+                env[name] = persisted[name]
+    loaded = dict(env)
+    env["context"] = ctx
+    env["content"] = ctx.get("content", "")
+    env["buffers"] = buffers
+
+    helpers = _make_helpers(ctx, buffers)
+    env.update(helpers)
+
+    if compiled is not None:
+        try:
+            with redirect_stdout(stdout_buf), redirect_stderr(stderr_buf):
+                exec(compiled, env, env)
+        except Exception:
+            traceback.print_exc(file=stderr_buf)
+
     # Pull back possibly mutated context/buffers.
     maybe_ctx = env.get("context")
     if isinstance(maybe_ctx, dict) and "content" in maybe_ctx:
@@ -525,7 +1442,8 @@ def cmd_exec(args: argparse.Namespace) -> int:
         state["buffers"] = maybe_buffers
         buffers = maybe_buffers
 
-    # Persist any new variables, excluding injected keys.
+    # Persist new or rebound variables, excluding injected keys. Persisted
+    # variables the code never referenced were not loaded and stay as they are.
     injected_keys = {
         "__builtins__",
         "context",
@@ -533,11 +1451,23 @@ def cmd_exec(args: argparse.Namespace) -> int:
         "buffers",
         *helpers.keys(),
     }
-    to_persist = {k: v for k, v in env.items() if k not in injected_keys}
-    filtered, dropped = _filter_pickleable(to_persist)
-    state["globals"] = filtered
-
-    _save_state(state, state_path)
+    for name, value in env.items():
+        if name in injected_keys:
+            continue
+        if name in loaded and value is loaded[name] and isinstance(value, _IMMUTABLE_TYPES):
+            continue
+        persisted[name] = value
+    for name in loaded:
+        if name not in env:
+            del persisted[name]
+
+    # The content file is only rewritten when exec replaced context['content'].
+    dropped = _save_state(
+        state,
+        state_dir,
+        save_content=ctx.get("content") is not content_before,
+        runtime_before=runtime_before,
+    )
 
     out = stdout_buf.getvalue()
     err = stderr_buf.getvalue()
@@ -578,8 +1508,8 @@ def build_parser() -> argparse.ArgumentParser:
     )
     p.add_argument(
         "--state",
-        default=str(DEFAULT_STATE_PATH),
-        help=f"Path to state pickle (default: {DEFAULT_STATE_PATH})",
+        default=str(DEFAULT_STATE_DIR),
+        help=f"Directory holding the REPL state (default: {DEFAULT_STATE_DIR})",
     )
 
     sub = p.add_subparsers(dest="cmd", required=True)
@@ -592,6 +1522,11 @@ def build_parser() -> argparse.ArgumentParser:
         default=None,
         help="Optional cap on bytes read from the context file",
     )
+    p_init.add_argument(
+        "--as-bytes",
+        action="store_true",
+        help="Keep content as raw bytes instead of decoding it as UTF-8",
+    )
     p_init.set_defaults(func=cmd_init)
 
     p_init_dir = sub.add_parser(
@@ -615,6 +1550,11 @@ def build_parser() -> argparse.ArgumentParser:
         default=None,
         help="Stop loading after this many total bytes",
     )
+    p_init_dir.add_argument(
+        "--as-bytes",
+        action="store_true",
+        help="Keep content as raw bytes instead of decoding it as UTF-8",
+    )
     p_init_dir.set_defaults(func=cmd_init_dir)
 
     p_status = sub.add_parser("status", help="Show current state summary")
@@ -623,7 +1563,7 @@ def build_parser() -> argparse.ArgumentParser:
     )
     p_status.set_defaults(func=cmd_status)
 
-    p_reset = sub.add_parser("reset", help="Delete the current state file and chunks")
+    p_reset = sub.add_parser("reset", help="Delete the current state files and chunks")
     p_reset.set_defaults(func=cmd_reset)
 
     p_export = sub.add_parser(